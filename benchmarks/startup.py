@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Cold start benchmark
+
+Times importing freezeLayer and running `freeze --help` in fresh
+interpreters, minus the time of an empty interpreter, and checks that
+importing the library loads none of the heavy dependencies. Exits with an
+error if either check fails, so it can guard startup time in CI.
+
+Usage:
+  startup.py [--runs=<n>] [--budget=<ms>]
+
+Options:
+  --runs=<n>      Interpreters to start per measurement [default: 10]
+  --budget=<ms>   Maximum median startup time in ms [default: 150]
+"""
+from __future__ import print_function, unicode_literals
+
+import os
+import sys
+import json
+import time
+import subprocess
+import docopt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ('requests', 'sqlparse', 'dateutil', 'cartosql', 'pyarrow',
+         'multiprocessing')
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def coldStart(args, runs):
+    '''Median wall time in seconds of running python args'''
+    times = []
+    for i in range(runs):
+        start = time.time()
+        subprocess.check_call([sys.executable] + args, cwd=ROOT,
+                              stdout=subprocess.DEVNULL)
+        times.append(time.time() - start)
+    return median(times)
+
+def loadedModules():
+    '''Heavy modules loaded by importing freezeLayer'''
+    out = subprocess.check_output([sys.executable, '-c',
+        'import sys, json, freezeLayer; '
+        'print(json.dumps(sorted(m for m in {} if m in sys.modules)))'
+        .format(list(HEAVY))], cwd=ROOT)
+    return json.loads(out.decode('utf-8'))
+
+def main():
+    args = docopt.docopt(__doc__)
+    runs = int(args['--runs'])
+    budget = float(args['--budget']) / 1000
+    ok = True
+
+    base = coldStart(['-c', 'pass'], runs)
+    for name, cmd in (('import freezeLayer', ['-c', 'import freezeLayer']),
+                      ('freeze --help', ['freeze', '--help'])):
+        t = coldStart(cmd, runs) - base
+        passed = t <= budget
+        ok = ok and passed
+        print('{:<20} {:7.1f} ms  {}'.format(name, t * 1000,
+                                             'ok' if passed else 'SLOW'))
+
+    loaded = loadedModules()
+    if loaded:
+        ok = False
+        print('Importing freezeLayer loaded: {}'.format(', '.join(loaded)))
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
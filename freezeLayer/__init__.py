@@ -12,42 +12,55 @@ except: from __builtin__ import str
 try: string_types = (str, basestring)
 except: string_types = str
 
-import requests
-import cartosql as csql
 import os
 import logging
-import sqlparse
 import json
 import datetime
-import dateutil.parser
 import hashlib
 
 try: import rw_api
 except: from . import rw_api
+from .lazy import lazyImport
+
+# heavy dependencies are imported on first use
+csql = lazyImport('cartosql')
+sqlparse = lazyImport('sqlparse')
+dateutil = lazyImport('dateutil', ('parser', 'tz'))
 
 def freezeLayer(layerId, start_date, end_date, time_field=None,
-                table_name=None, ignore_future=False):
+                table_name=None, ignore_future=False, coverage=None,
+                export=None, create_table=True, new_table=None):
     """
     Copies a CARTO layer's data to new table, and creates an idential layer
     pointing to the new table.
 
     @params
-    layerId      string    the layer to be copied
+    layerId      string    the layer to be copied, or a fetched <rw_api.Layer>
     start_date   datetime  the start of the period of data to copy
     end_date     datetime  the end of the period of data to copy
     [time_field] string    the field in which datetime information is stored
     [table_name] string    the main table name containing time data
     ignore_future  bool    do not warn if trying to query data in the future
+    [coverage]   CoverageIndex  local time index of table_name, used instead
+                           of querying for the latest data
+    [export]     string    also stream the rows to this local snapshot file
+                           (.csv.gz, .geojson.gz or .parquet)
+    create_table   bool    create the new table and layer on CARTO and RW
+    [new_table]  string    name of the table to create, see frozenTableName
 
     The table_name and time_field are read from Dataset definition if None.
 
     @return
-    tuple(<rw_api.Layer>, string) the new layer object and tableName
+    tuple(<rw_api.Layer>, string) the new layer object and tableName, or
+    (None, export) if not create_table
     """
 
     # 1. Fetch layer and dataset defition
-    logging.info('Fetching layer definition for {}'.format(layerId))
-    layer = rw_api.getLayer(layerId)
+    if isinstance(layerId, rw_api.Layer):
+        layer = layerId
+    else:
+        logging.info('Fetching layer definition for {}'.format(layerId))
+        layer = rw_api.getLayer(layerId)
     if not layer.provider == 'cartodb':
         raise("Layer must be of type 'cartodb'")
     if not time_field or not table_name:
@@ -65,34 +78,36 @@ def freezeLayer(layerId, start_date, end_date, time_field=None,
     if start_date > end_date:
         start_date, end_date = (end_date, start_date)
     if not ignore_future:
-        checkFutureData(end_date, table_name, time_field)
+        checkFutureData(end_date, table_name, time_field, coverage)
+    if coverage is not None:
+        logging.info('Estimated rows to copy: {}'.format(
+            coverage.count(start_date, end_date)))
 
     # 3. Modify the layer SQL query, replacing any where clauses referring to
     # time_field with new ones selecting for the start and end date
     logging.debug('Query: {}'.format(sql))
     start = start_date.isoformat()
     end = end_date.isoformat()
-    time_clauses = findTimeClauses(sql, time_field)
-    new_cls = " {time_field} >= '{start}' and {time_field} < '{end}'".format(
-        time_field=time_field, start=start, end=end)
-    for cls in time_clauses:
-        sql = sql.replace(cls, new_cls)
+    sql = replaceTimeClauses(sql, time_field, start, end)
     logging.debug('New query: {}'.format(sql))
 
+    if export:
+        from .export import exportQuery
+        exportQuery(sql, export)
+    if not create_table:
+        return (None, export)
 
     # 4. Create the table from the updated layer SQL query
 
-    # Name new table with start and end dates, make sure it isn't too long
-    new_table = "{}_{}_{}".format(table_name, start_date.strftime("%Y%m%d_%H%M"), end_date.strftime("%Y%m%d_%H%M"))
-    if len(new_table) > 62:
-        new_table = "{}_{}".format(new_table[:32], hashlib.md5(new_table[32:]))
+    new_table = new_table or frozenTableName(table_name, start_date, end_date)
 
     # If we've made this exact query before, replace it
     logging.info("Coping data to table: {}".format(table_name))
-    if csql.tableExists(new_table):
+    if cartoCall(csql.tableExists, new_table):
         logging.info("Table {} exists, overwriting".format(new_table))
-        csql.dropTable(new_table)
-    csql.createTableFromQuery(new_table, sql)
+        cartoCall(csql.dropTable, new_table)
+    cartoCall(csql.createTableFromQuery, new_table, sql, idempotent=False,
+              kind=None)
 
     # 5. Create layer copy and update SQL to refer to new table
     layer_name = "{} ({} to {})".format(layer.name, start, end)
@@ -113,6 +128,16 @@ class FutureDataError(Exception):
     ''''''
     pass
 
+def frozenTableName(table_name, start_date, end_date, suffix=None):
+    '''Name new table with start and end dates, make sure it isn't too long'''
+    new_table = "{}_{}_{}".format(table_name, start_date.strftime("%Y%m%d_%H%M"), end_date.strftime("%Y%m%d_%H%M"))
+    if suffix:
+        new_table = "{}_{}".format(new_table, suffix)
+    if len(new_table) > 62:
+        digest = hashlib.md5(new_table[32:].encode('utf-8')).hexdigest()
+        new_table = "{}_{}".format(new_table[:32], digest[:16])
+    return new_table
+
 def asUTC(date, tz=None):
     ''''''
     if isinstance(date, string_types):
@@ -120,15 +145,20 @@ def asUTC(date, tz=None):
     if date.tzinfo is None:
         if tz is None:
             logging.debug('Assuming time already in utc')
-            date.replace(tzinfo=dateutil.tz.UTC)
+            date = date.replace(tzinfo=dateutil.tz.UTC)
         else:
             date = date.astimezone(dateutil.tz.UTC)
     return date
 
-def checkFutureData(date, table_name, time_field):
-    '''Check if date is more recent than latest data'''
-    latest_date = getFieldAsList(time_field, table_name,
-                                 order='{} DESC LIMIT 1'.format(time_field))[0]
+def checkFutureData(date, table_name, time_field, coverage=None):
+    '''Check if date is more recent than latest data
+
+    Reads the latest date from coverage if given, otherwise queries the table.
+    '''
+    latest_date = coverage and coverage.latest()
+    if latest_date is None:
+        latest_date = getFieldAsList(time_field, table_name,
+                                     order='{} DESC LIMIT 1'.format(time_field))[0]
     latest_date = asUTC(latest_date)
     now = asUTC(datetime.datetime.utcnow())
     logging.debug('Now: ' + now.ctime())
@@ -144,7 +174,17 @@ def checkFutureData(date, table_name, time_field):
 
 def getFieldAsList(field, table, **args):
     ''''''
-    return csql.getFields(field, table, f='csv', **args).text.splitlines()[1:]
+    return cartoCall(csql.getFields, field, table, f='csv',
+                     **args).text.splitlines()[1:]
+
+def cartoCall(fn, *args, **kwargs):
+    '''Call cartosql fn through the rate limiter for the CARTO account
+
+    Pass idempotent=False if fn must not be retried after a server error,
+    and kind=None for long running queries that should not count as slow.
+    '''
+    host = '{}.carto.com'.format(csql.CARTO_USER)
+    return rw_api.limited(host, fn, *args, **kwargs)
 
 # Parsing SQL
 def _findWheres(group):
@@ -193,6 +233,20 @@ def findTimeClauses(sql, timename):
         timeexprs.extend(_findTimeClause(w, timename))
     return timeexprs
 
+def replaceTimeClauses(sql, time_field, start, end, time_clauses=None):
+    '''Replace WHERE expressions referring to time_field with start <= t < end
+
+    start and end are iso formatted dates, time_clauses are found in sql if
+    None.
+    '''
+    if time_clauses is None:
+        time_clauses = findTimeClauses(sql, time_field)
+    new_cls = " {time_field} >= '{start}' and {time_field} < '{end}'".format(
+        time_field=time_field, start=start, end=end)
+    for cls in time_clauses:
+        sql = sql.replace(cls, new_cls)
+    return sql
+
 # test
 def test():
     ''''''
@@ -205,7 +259,7 @@ def test():
     layerId, table = freezeLayer(lyr, start_time, end_time, time_field, table_name, True)
     print(('Created: ', layerId, table))
     rw_api.Layer(layerId).delete()
-    csql.dropTable(table)
+    cartoCall(csql.dropTable, table)
     print(('Deleted: ', layerId, table))
 
 
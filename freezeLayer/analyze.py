@@ -0,0 +1,166 @@
+'''
+Bulk freezability analysis
+
+Checks every layer in the RW catalog for the conditions freezeLayer needs:
+a cartodb provider, a dataset with a mainDateField, and time clauses in the
+layer SQL that can be rewritten. SQL is parsed on a process pool and the
+parsed clauses are cached by hash so reruns only reparse changed layers.
+
+A layer is only freezable if replacing its time clauses with a date range
+leaves the range intact; clauses that were not found whole would leave
+part of the old expression behind and break the frozen query.
+'''
+from __future__ import unicode_literals
+
+import os
+import json
+import hashlib
+import logging
+import multiprocessing
+
+from . import rw_api, sqlparse, findTimeClauses, replaceTimeClauses
+
+# date range used to check that time clauses can be replaced
+_START = '2000-01-01T00:00:00+00:00'
+_END = '2000-01-02T00:00:00+00:00'
+
+def sqlHash(sql, time_field):
+    '''Cache key for the time clauses of sql on time_field'''
+    key = '{}\n{}'.format(time_field, sql)
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+def loadCache(cache_file):
+    '''Read cached {sqlHash: {clauses, reason}} from cache_file'''
+    if not cache_file or not os.path.exists(cache_file):
+        return {}
+    with open(cache_file) as f:
+        return json.load(f)
+
+def saveCache(cache, cache_file):
+    '''Write {sqlHash: {clauses, reason}} to cache_file'''
+    if not cache_file:
+        return
+    tmp = cache_file + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(cache, f)
+    os.rename(tmp, cache_file)
+
+def _layerResult(layer, datasets):
+    '''Run the cheap checks on layer, return a partially filled result'''
+    result = {
+        'layerId': layer.Id,
+        'name': layer.attributes.get('name'),
+        'datasetId': layer.attributes.get('dataset'),
+        'tableName': None,
+        'timeField': None,
+        'sql': None,
+        'freezable': False,
+        'clauses': None,
+        'reason': None
+    }
+    if layer.attributes.get('provider') != 'cartodb':
+        result['reason'] = "Provider is {}, not 'cartodb'".format(
+            layer.attributes.get('provider'))
+        return result
+    dataset = datasets.get(result['datasetId'])
+    if dataset is None:
+        result['reason'] = 'Dataset {} not found'.format(result['datasetId'])
+        return result
+    result['tableName'] = dataset.attributes.get('tableName')
+    result['timeField'] = dataset.attributes.get('mainDateField')
+    if not result['timeField']:
+        result['reason'] = 'Dataset does not have mainDateField defined'
+        return result
+    try:
+        result['sql'] = layer.layerConfig['options']['sql'].lower()
+    except (KeyError, IndexError, TypeError, AttributeError):
+        result['reason'] = 'Layer config does not contain sql'
+    return result
+
+def replacesCleanly(sql, time_field, clauses):
+    '''
+    True if replacing clauses in sql as freezeLayer does leaves each new date
+    range intact, with no part of an old clause left behind
+    '''
+    new_sql = replaceTimeClauses(sql, time_field, _START, _END, clauses)
+    end = "'{}'".format(_END)
+    tokens = [t for t in sqlparse.parse(new_sql)[0].flatten()]
+    for i, t in enumerate(tokens):
+        if _END not in t.value:
+            continue
+        # e.g. "interval '1 day'" cut to "interval " joins the end date
+        # into "'...''1 day'"
+        if t.value != end:
+            return False
+        following = tokens[i+1:i+2]
+        if following and not (following[0].is_whitespace or
+                              following[0].match(sqlparse.tokens.Punctuation,
+                                                 (')', ';', ','))):
+            return False
+    return True
+
+def _parse(result):
+    '''Find time clauses for a result that passed the cheap checks'''
+    if result['reason'] is None and result['clauses'] is None:
+        try:
+            result['clauses'] = findTimeClauses(result['sql'],
+                                                result['timeField'])
+        except Exception as e:
+            result['reason'] = 'Could not parse sql: {}'.format(e)
+            return result
+        if not replacesCleanly(result['sql'], result['timeField'],
+                               result['clauses']):
+            result['reason'] = 'Time clauses cannot be fully replaced'
+    return result
+
+def analyzeLayers(layers=None, datasets=None, cache_file=None,
+                  processes=None, chunksize=16):
+    '''
+    Yield a freezability report for each layer
+
+    @params
+    [layers]     iterable  rw_api.Layer objects, all layers if None
+    [datasets]   iterable  rw_api.Dataset objects, all datasets if None
+    [cache_file] string    json file caching parsed clauses by sql hash
+    [processes]  int       size of the sql parsing pool
+    [chunksize]  int       layers sent to a worker at a time
+
+    @yield
+    dict with keys layerId, name, datasetId, tableName, timeField, sql,
+    freezable, clauses and reason (why the layer is not freezable)
+    '''
+    if layers is None:
+        layers = rw_api.iterLayers(published=False)
+    if datasets is None:
+        logging.info('Fetching dataset definitions')
+        datasets = rw_api.iterDatasets(published=False)
+    datasets = dict((d.Id, d) for d in datasets)
+    cache = loadCache(cache_file)
+
+    def tasks():
+        for layer in layers:
+            result = _layerResult(layer, datasets)
+            if result['reason'] is None:
+                key = sqlHash(result['sql'], result['timeField'])
+                cached = cache.get(key)
+                # entries of older caches held only clauses, reparse those
+                if isinstance(cached, dict):
+                    result['clauses'] = cached['clauses']
+                    result['reason'] = cached['reason']
+            yield result
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap(_parse, tasks(), chunksize):
+            if result['clauses'] is not None:
+                key = sqlHash(result['sql'], result['timeField'])
+                cache[key] = {'clauses': result['clauses'],
+                              'reason': result['reason']}
+                if not result['clauses']:
+                    result['reason'] = 'No where clauses refer to {}'.format(
+                        result['timeField'])
+            result['freezable'] = result['reason'] is None
+            yield result
+    finally:
+        pool.terminate()
+        saveCache(cache, cache_file)
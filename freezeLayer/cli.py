@@ -1,8 +1,39 @@
 #!/usr/bin/env python
+"""
+Freeze a Resource Watch layer
+
+Usage:
+  freeze [--production]
+  freeze analyze [--production] [options]
+  freeze schedule <config> [--production] [options]
+  freeze load <snapshot> <table> [--overwrite]
+  freeze -h | --help
+
+Options:
+  --production        Use the production RW API
+  --cache=<file>      Cache parsed SQL clauses in this file
+                      [default: .freeze_analyze_cache.json]
+  --processes=<n>     SQL parsing pool size, 0 for cpu count [default: 0]
+  --json              Print one json report per layer
+  --only-freezable    Only report freezable layers
+  --state=<file>      Schedule state file [default: .freeze_schedule.json]
+  --workers=<n>       Number of freezes to run at once [default: 2]
+  --interval=<s>      Seconds between checks for due windows [default: 60]
+  --overwrite         Drop the table if it exists
+"""
 from __future__ import unicode_literals
 
-from freezeLayer import *
-import requests
+import json
+import logging
+import datetime
+import docopt
+
+from freezeLayer import rw_api, csql, freezeLayer, asUTC, checkFutureData, \
+    getFieldAsList, cartoCall, FutureDataError
+from freezeLayer.lazy import lazyImport
+
+# imported on first use
+requests = lazyImport('requests')
 
 try: input = raw_input
 except: pass
@@ -70,12 +101,12 @@ def validateDate(datestr):
         print('Invalid date.')
         return False
 
-def validateEndDate(datestr, table, time_field):
+def validateEndDate(datestr, table, time_field, coverage=None):
     date = validateDate(datestr)
     if not date:
         return False
     try:
-        checkFutureData(date, table, time_field)
+        checkFutureData(date, table, time_field, coverage)
         return date
     except FutureDataError as e:
         print(e)
@@ -83,9 +114,77 @@ def validateEndDate(datestr, table, time_field):
             return date
         return False
 
+def loadCoverage(table, time_field):
+    from freezeLayer.coverage import CoverageIndex
+    try:
+        return CoverageIndex(table, time_field).refresh()
+    except Exception as e:
+        print('\nCould not index data availability, skipping')
+        print('({})'.format(e))
+        return None
+
+def printCoverage(coverage, days=7):
+    if coverage.latest() is None:
+        print('\nNo data in {}'.format(coverage.table_name))
+        return
+    print('\nData available from {} to {}'.format(
+        coverage.earliest().ctime(), coverage.latest().ctime()))
+    for day, rows in coverage.daily()[-days:]:
+        print('  {}: {} rows'.format(day.isoformat(), rows))
+
+def analyze(args):
+    from freezeLayer.analyze import analyzeLayers
+    rw_api.init(production=args['--production'], check_auth=False)
+    processes = int(args['--processes']) or None
+    total = freezable = 0
+    for result in analyzeLayers(cache_file=args['--cache'],
+                                processes=processes):
+        total += 1
+        freezable += result['freezable']
+        if args['--only-freezable'] and not result['freezable']:
+            continue
+        if args['--json']:
+            del result['sql']
+            print(json.dumps(result))
+        elif result['freezable']:
+            print('{}\tfreezable\t{}'.format(result['layerId'],
+                                              ' | '.join(result['clauses'])))
+        else:
+            print('{}\tnot freezable\t{}'.format(result['layerId'],
+                                                  result['reason']))
+    if not args['--json']:
+        print('\n{} of {} layers freezable'.format(freezable, total))
+
+def schedule(args):
+    from freezeLayer.schedule import Scheduler
+    logging.basicConfig(level=logging.INFO)
+    scheduler = Scheduler.fromConfig(args['<config>'],
+                                     state_file=args['--state'],
+                                     workers=int(args['--workers']),
+                                     interval=int(args['--interval']))
+    try:
+        scheduler.run(production=args['--production'])
+    except KeyboardInterrupt:
+        print('Stopped')
+
+def load(args):
+    from freezeLayer.export import loadSnapshot
+    logging.basicConfig(level=logging.INFO)
+    csql.init()
+    table = loadSnapshot(args['<snapshot>'], args['<table>'],
+                         overwrite=args['--overwrite'])
+    print('Table name: "{}".{}'.format(csql.CARTO_USER, table))
+
 def main():
+    args = docopt.docopt(__doc__)
+    if args['load']:
+        return load(args)
+    if args['analyze']:
+        return analyze(args)
+    if args['schedule']:
+        return schedule(args)
     csql.init()
-    if not askYn('\nUse test enviornment ({})?'.format(rw_api.API_URL)):
+    if args['--production'] or not askYn('\nUse test enviornment ({})?'.format(rw_api.API_URL)):
         rw_api.init(production=True)
         print('Using production: ' + rw_api.util._api_url)
     lyr = ask('\nID of Layer to freeze: ', validateLayer)
@@ -105,15 +204,22 @@ def main():
             return
     time_field = dataset.mainDateField
 
+    coverage = loadCoverage(table, time_field)
+    if coverage:
+        printCoverage(coverage)
+
     print ('\nEnter start date for freeze')
     start = ask('(YYYY-MM-DD | today | yesterday): ', validateDate)
     print ('Query start: ' + start.ctime())
     print ('\nEnter end date for freeze')
     end = ask('(YYYY-MM-DD | today | yesterday): ', validateEndDate,
-              table, time_field)
+              table, time_field, coverage)
     print ('Query end: ' + end.ctime())
+    if coverage:
+        print ('Estimated rows: {}'.format(coverage.count(start, end)))
 
-    lyr, table = freezeLayer(lyr.Id, start, end, time_field, table, ignore_future=True)
+    lyr, table = freezeLayer(lyr.Id, start, end, time_field, table,
+                             ignore_future=True, coverage=coverage)
 
     print ('\nCreated new layer.')
     print ('Layer Id: ' + lyr.Id)
@@ -125,7 +231,7 @@ def main():
     if not askYn('\nKeep new layer and table?'):
         lyr.delete()
         print('Deleted layer: {}'.format(lyr.Id))
-        csql.dropTable(table)
+        cartoCall(csql.dropTable, table)
         print('Dropped table: {} '.format(table))
 
     elif askYn('\nRename layer?'):
@@ -0,0 +1,162 @@
+'''
+Time coverage index for source tables
+
+Keeps row counts per hour of a table's time field, plus the earliest and
+latest timestamps, in a local json file. The index is refreshed
+incrementally from the last bucket seen, so checking the latest data or
+estimating the size of a freeze window needs no query to CARTO.
+
+Example:
+
+index = CoverageIndex('cit_003a_air_quality_pm25', 'utc').refresh()
+index.latest()                      # most recent timestamp in the table
+index.count(start, end)             # estimated rows between start and end
+'''
+from __future__ import unicode_literals
+
+import os
+import json
+import datetime
+import logging
+
+from . import csql, dateutil, asUTC, cartoCall
+
+COVERAGE_DIR = os.environ.get('FREEZE_COVERAGE_DIR') or '.freeze_coverage'
+BUCKET = datetime.timedelta(hours=1)
+_KEY_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+def _naiveUTC(date):
+    '''Return date as a naive datetime in UTC'''
+    date = asUTC(date)
+    if date.tzinfo is not None:
+        date = date.astimezone(dateutil.tz.UTC)
+    return date.replace(tzinfo=None)
+
+def _bucket(date):
+    '''Truncate date to the start of its bucket'''
+    return _naiveUTC(date).replace(minute=0, second=0, microsecond=0)
+
+def _key(date):
+    return date.strftime(_KEY_FORMAT)
+
+def _date(key):
+    return datetime.datetime.strptime(key, _KEY_FORMAT)
+
+
+class CoverageIndex(object):
+    '''Hourly row counts for time_field in table_name'''
+
+    def __init__(self, table_name, time_field, path=None):
+        self.table_name = table_name
+        self.time_field = time_field
+        self.path = path or os.path.join(
+            COVERAGE_DIR, '{}.{}.json'.format(table_name, time_field))
+        self.counts = {}
+        self.min = None
+        self.max = None
+        self.updated = None
+        self.load()
+
+    def __repr__(self):
+        return '<CoverageIndex: {}.{}>'.format(self.table_name,
+                                               self.time_field)
+
+    def load(self):
+        '''Read index from disk if it exists'''
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                data = json.load(f)
+            self.counts = data['counts']
+            self.min = data['min'] and _date(data['min'])
+            self.max = data['max'] and _date(data['max'])
+            self.updated = data['updated'] and _date(data['updated'])
+        return self
+
+    def save(self):
+        '''Write index to disk'''
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        data = {
+            'table': self.table_name,
+            'field': self.time_field,
+            'counts': self.counts,
+            'min': self.min and _key(self.min),
+            'max': self.max and _key(self.max),
+            'updated': self.updated and _key(self.updated)
+        }
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f, sort_keys=True)
+        os.rename(tmp, self.path)
+        return self
+
+    def refresh(self, full=False):
+        '''
+        Query buckets at or after the last bucket seen and save the index
+
+        The last bucket is recounted as it may have been partial. Rows added
+        before it are not seen; use full=True to rebuild the whole index.
+        '''
+        since = None if full or self.max is None else _bucket(self.max)
+        where = ''
+        if since is not None:
+            where = "WHERE {} >= '{}'".format(self.time_field, since.isoformat())
+        sql = ("SELECT date_trunc('hour', {f}) AS bucket, count(*) AS n, "
+               "min({f}) AS first, max({f}) AS last FROM {t} {w} "
+               "GROUP BY 1 ORDER BY 1").format(
+                   f=self.time_field, t=self.table_name, w=where)
+        logging.debug('Coverage query: {}'.format(sql))
+        rows = cartoCall(csql.get, sql, kind=None).json()['rows']
+        if full:
+            self.counts = {}
+            self.min = None
+        for row in rows:
+            if row['bucket'] is None:
+                continue
+            self.counts[_key(_bucket(row['bucket']))] = row['n']
+            first, last = _naiveUTC(row['first']), _naiveUTC(row['last'])
+            if self.min is None or first < self.min:
+                self.min = first
+            if self.max is None or last > self.max:
+                self.max = last
+        self.updated = _naiveUTC(datetime.datetime.utcnow())
+        logging.info('Coverage for {}: {} rows from {} to {}'.format(
+            self, self.total(), self.min, self.max))
+        return self.save()
+
+    def latest(self):
+        '''Most recent timestamp in the table, or None if index is empty'''
+        return self.max and self.max.replace(tzinfo=dateutil.tz.UTC)
+
+    def earliest(self):
+        '''Earliest timestamp in the table, or None if index is empty'''
+        return self.min and self.min.replace(tzinfo=dateutil.tz.UTC)
+
+    def total(self):
+        '''Total number of rows indexed'''
+        return sum(self.counts.values())
+
+    def count(self, start_date, end_date):
+        '''
+        Estimate rows with start_date <= time_field < end_date
+
+        Buckets partially inside the window are prorated by overlap.
+        '''
+        start, end = _naiveUTC(start_date), _naiveUTC(end_date)
+        total = 0.0
+        for key, n in self.counts.items():
+            b_start = _date(key)
+            b_end = b_start + BUCKET
+            overlap = min(end, b_end) - max(start, b_start)
+            if overlap > datetime.timedelta(0):
+                total += n * (overlap.total_seconds() / BUCKET.total_seconds())
+        return int(round(total))
+
+    def daily(self):
+        '''Return sorted list of (date, rows) per day'''
+        days = {}
+        for key, n in self.counts.items():
+            day = _date(key).date()
+            days[day] = days.get(day, 0) + n
+        return sorted(days.items())
@@ -0,0 +1,289 @@
+'''
+Local snapshots of frozen windows
+
+Streams the rows of a query from the CARTO SQL API straight to a local file,
+reading the HTTP response in chunks so memory stays bounded, and loads such
+snapshots back into a CARTO table.
+
+Formats are chosen by file extension:
+  .csv.gz, .csv          CSV, geometry as GeoJSON
+  .geojson.gz, .geojson  GeoJSON feature collection
+  .parquet               Parquet, geometry as GeoJSON (requires pyarrow)
+
+The column types of the query are saved next to the snapshot in
+<path>.schema.json, and used to recreate the table on load. Numbers are
+kept exact: integer and float columns keep their postgres type, and
+numeric columns are stored as text in Parquet. Files are
+written to <path>.tmp and renamed when complete, so an interrupted export
+leaves no snapshot behind. GeoJSON snapshots cannot be loaded, as they
+cannot be read with bounded memory; use csv or parquet for archives.
+'''
+from __future__ import unicode_literals
+
+import io
+import os
+import csv
+import gzip
+import json
+import decimal
+import logging
+from collections import OrderedDict
+
+from . import csql, cartoCall
+from .lazy import lazyImport
+
+requests = lazyImport('requests')
+pyarrow = None
+
+SQL_API = 'https://{}.carto.com/api/v2/sql'
+CHUNK_SIZE = 2 ** 16
+BATCH_SIZE = 10000
+
+# CARTO SQL API field types to postgres types
+PG_TYPES = {
+    'number': 'numeric',
+    'string': 'text',
+    'date': 'timestamp',
+    'boolean': 'boolean',
+    'geometry': 'geometry'
+}
+# exact postgres types of number fields, when the API reports them
+PG_NUMBER_TYPES = {
+    'int2': 'smallint',
+    'int4': 'integer',
+    'int8': 'bigint',
+    'float4': 'real',
+    'float8': 'double precision'
+}
+INTEGER_TYPES = ('smallint', 'integer', 'bigint')
+FLOAT_TYPES = ('real', 'double precision')
+# columns maintained by CARTO
+SKIP_FIELDS = ('cartodb_id', 'the_geom_webmercator')
+
+def snapshotFormat(path):
+    '''Return (format, compressed) for a snapshot path'''
+    for ext in ('csv', 'geojson', 'parquet'):
+        if path.endswith('.' + ext):
+            return ext, False
+        if path.endswith('.{}.gz'.format(ext)) and ext != 'parquet':
+            return ext, True
+    raise ValueError('Unknown snapshot format for {}, use .csv.gz, '
+                     '.geojson.gz or .parquet'.format(path))
+
+def _requireParquet():
+    '''Import pyarrow, an optional dependency'''
+    global pyarrow
+    if pyarrow is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('Parquet snapshots require pyarrow '
+                              '(pip install pyarrow)')
+
+def _open(path, mode, compressed):
+    if compressed:
+        return gzip.open(path, mode)
+    return io.open(path, mode)
+
+def _post(sql, f, kind=None):
+    '''POST sql to the CARTO SQL API and return the streaming response'''
+    def send():
+        r = requests.post(SQL_API.format(csql.CARTO_USER),
+                          data={'q': sql, 'api_key': csql.CARTO_KEY,
+                                'format': f},
+                          stream=True)
+        r.raise_for_status()
+        return r
+    return cartoCall(send, kind=kind)
+
+def querySchema(sql):
+    '''Return OrderedDict of {field: postgres type} for the rows of sql'''
+    r = _post('SELECT * FROM ({}) q LIMIT 0'.format(sql), 'json', 'schema')
+    fields = r.json(object_pairs_hook=OrderedDict)['fields']
+    schema = OrderedDict()
+    for k, v in fields.items():
+        if k not in SKIP_FIELDS:
+            schema[k] = PG_TYPES.get(v['type'], 'text')
+            if schema[k] == 'numeric':
+                schema[k] = PG_NUMBER_TYPES.get(v.get('pgtype'), 'numeric')
+    return schema
+
+def _exportSql(sql, schema):
+    '''Select schema fields from sql with geometries as GeoJSON'''
+    fields = []
+    for k, t in schema.items():
+        if t == 'geometry':
+            fields.append('ST_AsGeoJSON({0}) AS {0}'.format(k))
+        else:
+            fields.append(k)
+    return 'SELECT {} FROM ({}) q'.format(', '.join(fields), sql)
+
+def _csvRows(response, schema):
+    '''Iterate over rows of a streaming csv response ordered like schema'''
+    response.raw.decode_content = True
+    # urllib3 closes the response once the body is read, before the text
+    # wrapper reading it is done
+    response.raw.auto_close = False
+    reader = csv.reader(io.TextIOWrapper(response.raw, encoding='utf-8',
+                                         newline=''))
+    header = next(reader)
+    index = [header.index(k) for k in schema]
+    for row in reader:
+        yield [row[i] for i in index]
+
+def _writeParquet(rows, path, schema):
+    _requireParquet()
+    # numeric values of unknown precision are kept as exact text
+    types = dict([(t, pyarrow.int64()) for t in INTEGER_TYPES] +
+                 [(t, pyarrow.float64()) for t in FLOAT_TYPES] +
+                 [('boolean', pyarrow.bool_())])
+    pa_schema = pyarrow.schema([(k, types.get(t, pyarrow.string()))
+                                for k, t in schema.items()])
+    writer = pyarrow.parquet.ParquetWriter(path, pa_schema)
+    try:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= BATCH_SIZE:
+                _writeBatch(writer, batch, schema, pa_schema)
+                batch = []
+        if batch:
+            _writeBatch(writer, batch, schema, pa_schema)
+    finally:
+        writer.close()
+
+def _writeBatch(writer, batch, schema, pa_schema):
+    columns = dict((k, [_parseValue(row[i], schema[k], parquet=True)
+                        for row in batch])
+                   for i, k in enumerate(schema))
+    writer.write_table(pyarrow.Table.from_pydict(columns, schema=pa_schema))
+
+def exportQuery(sql, path):
+    '''
+    Stream the rows of sql to a local snapshot file
+
+    @params
+    sql     string  query selecting the rows to export
+    path    string  snapshot file, format chosen by extension
+
+    @return
+    string  the snapshot path
+    '''
+    fmt, compressed = snapshotFormat(path)
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    schema = querySchema(sql)
+    schema_path = path + '.schema.json'
+    tmp, schema_tmp = path + '.tmp', schema_path + '.tmp'
+
+    logging.info('Exporting query to {}'.format(path))
+    if fmt == 'geojson':
+        r = _post(sql, 'geojson')
+    else:
+        r = _post(_exportSql(sql, schema), 'csv')
+    try:
+        with io.open(schema_tmp, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(schema, indent=2, ensure_ascii=False))
+        if fmt == 'parquet':
+            _writeParquet(_csvRows(r, schema), tmp, schema)
+        else:
+            with _open(tmp, 'wb', compressed) as f:
+                for chunk in r.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+        # the snapshot appears last, once its schema is in place
+        os.rename(schema_tmp, schema_path)
+        os.rename(tmp, path)
+    finally:
+        r.close()
+        for f in (tmp, schema_tmp):
+            if os.path.exists(f):
+                os.remove(f)
+    return path
+
+def _parseValue(value, dtype, parquet=False):
+    '''
+    Convert a csv or parquet value to its python type, or to the type of its
+    parquet column, where numeric and geometry values stay text
+    '''
+    if value is None or value == '':
+        return None
+    if dtype in INTEGER_TYPES:
+        return int(value)
+    if dtype in FLOAT_TYPES:
+        return float(value)
+    if dtype == 'boolean':
+        return value in ('true', 't', True)
+    if parquet:
+        return value
+    if dtype == 'numeric':
+        # exact, and str() gives back the original digits for insertRows
+        return decimal.Decimal(str(value))
+    if dtype == 'geometry':
+        return json.loads(value)
+    return value
+
+def _readRows(path, schema):
+    '''Iterate over snapshot rows as lists ordered like schema'''
+    fmt, compressed = snapshotFormat(path)
+    if fmt == 'parquet':
+        _requireParquet()
+        source = pyarrow.parquet.ParquetFile(path)
+        for batch in source.iter_batches(BATCH_SIZE, columns=list(schema)):
+            columns = batch.to_pydict()
+            for row in zip(*[columns[k] for k in schema]):
+                yield [_parseValue(v, t) for v, t in
+                       zip(row, schema.values())]
+    elif fmt == 'csv':
+        with _open(path, 'rb', compressed) as f:
+            reader = csv.reader(io.TextIOWrapper(f, encoding='utf-8',
+                                                 newline=''))
+            header = next(reader)
+            index = [header.index(k) for k in schema]
+            for row in reader:
+                yield [_parseValue(row[i], t) for i, t in
+                       zip(index, schema.values())]
+    else:
+        raise ValueError('Cannot load {} snapshots, use csv or parquet'
+                         .format(fmt))
+
+def loadSnapshot(path, table_name, overwrite=False):
+    '''
+    Create a CARTO table from a snapshot written by exportQuery
+
+    @params
+    path        string  snapshot file
+    table_name  string  table to create
+    overwrite   bool    drop table_name if it exists
+
+    @return
+    string  the table name
+    '''
+    if snapshotFormat(path)[0] == 'geojson':
+        raise ValueError('GeoJSON snapshots cannot be loaded with bounded '
+                         'memory, export to .csv.gz or .parquet instead')
+    with io.open(path + '.schema.json', encoding='utf-8') as f:
+        schema = json.load(f, object_pairs_hook=OrderedDict)
+
+    if cartoCall(csql.tableExists, table_name):
+        if not overwrite:
+            raise Exception('Table {} exists'.format(table_name))
+        logging.info("Table {} exists, overwriting".format(table_name))
+        cartoCall(csql.dropTable, table_name)
+    logging.info('Loading {} to table {}'.format(path, table_name))
+    cartoCall(csql.createTable, table_name, schema, idempotent=False)
+
+    batch = []
+    for row in _readRows(path, schema):
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            cartoCall(csql.insertRows, table_name, list(schema),
+                      list(schema.values()), batch, idempotent=False,
+                      kind='insert')
+            batch = []
+    if batch:
+        cartoCall(csql.insertRows, table_name, list(schema),
+                  list(schema.values()), batch, idempotent=False,
+                  kind='insert')
+    return table_name
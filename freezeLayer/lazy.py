@@ -0,0 +1,30 @@
+'''Lazy imports for heavy and optional dependencies'''
+from __future__ import unicode_literals
+
+import importlib
+
+class LazyModule(object):
+    '''Stand-in for a module that is imported on first attribute access'''
+
+    def __init__(self, name, submodules=()):
+        self._name = name
+        self._submodules = submodules
+        self._module = None
+
+    def __repr__(self):
+        return '<LazyModule: {}>'.format(self._name)
+
+    def _load(self):
+        if self._module is None:
+            module = importlib.import_module(self._name)
+            for sub in self._submodules:
+                importlib.import_module('{}.{}'.format(self._name, sub))
+            self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+def lazyImport(name, submodules=()):
+    '''Return a LazyModule for name, also importing name.<submodules>'''
+    return LazyModule(name, submodules)
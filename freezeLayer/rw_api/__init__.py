@@ -3,7 +3,7 @@ Simple Python SDK for data management on RW API
 
 Examples:
 
-# Initialize
+# Initialize (optional, defaults to RW_API_KEY and RW_API_URL)
 import rw
 rw.init(<api_key>, production=True)
 
@@ -21,10 +21,10 @@ try: from builtins import str
 except: from __builtin__ import str
 
 import json
-import requests
 import os
 from .Objects import Dataset, Layer #, Metadata, Widget
 from .util import auth, req
+from .limiter import limited, configure
 
 # constants
 API_URL = os.environ.get('RW_API_URL') or \
@@ -65,8 +65,35 @@ def getDatasets(app='', published=True, includes='', limit=10000, **args):
     data = req('GET', Dataset._ENDPOINT, args)
     return [Dataset(r['id'], attributes=r['attributes']) for r in data]
 
+def _iterPages(endpoint, args, pagesize):
+    '''Yield records from endpoint one page at a time'''
+    args['page[size]'] = pagesize
+    page = 1
+    while True:
+        args['page[number]'] = page
+        data = req('GET', endpoint, args)
+        for r in data:
+            yield r
+        if len(data) < pagesize:
+            return
+        page += 1
+
+def iterLayers(app='', published=True, pagesize=100, **args):
+    '''Iterate over layers, fetching pagesize layers at a time'''
+    app = ','.join(app) if type(app) is list else app
+    if app: args['app'] = app
+    if published: args['published'] = published
+    for r in _iterPages(Layer._GET_ENDPOINT, args, pagesize):
+        yield Layer(r['id'], attributes=r['attributes'])
+
+def iterDatasets(app='', published=True, pagesize=100, **args):
+    '''Iterate over datasets, fetching pagesize datasets at a time'''
+    app = ','.join(app) if type(app) is list else app
+    if app: args['app'] = app
+    if published: args['published'] = published
+    for r in _iterPages(Dataset._ENDPOINT, args, pagesize):
+        yield Dataset(r['id'], attributes=r['attributes'])
 
-init(check_auth=False)
 
 '''
 TODO
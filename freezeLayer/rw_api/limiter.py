@@ -0,0 +1,212 @@
+'''
+Client side rate limiting for outbound API calls
+
+Calls are grouped by host. Each host has
+  - a token bucket limiting requests per second
+  - an adaptive concurrency limit, raised by one per window of fast
+    successful calls and halved on 429s, 5xx, connection errors or slow
+    responses (AIMD). Latency is tracked per kind of call, and calls with
+    kind=None, such as long running queries, are not checked for latency
+  - a circuit breaker that fails fast after repeated errors and lets a
+    single trial call through after a cooldown
+
+Example:
+
+from rw_api.limiter import limited
+response = limited('api.resourcewatch.org', requests.get, url)
+
+Defaults can be set with the environment variables FREEZE_RATE_LIMIT
+(requests per second) and FREEZE_MAX_CONCURRENCY, or per host with
+configure(host, **params).
+'''
+from __future__ import unicode_literals
+
+import os
+import time
+import random
+import logging
+import threading
+
+RATE = float(os.environ.get('FREEZE_RATE_LIMIT') or 10)
+MAX_CONCURRENCY = int(os.environ.get('FREEZE_MAX_CONCURRENCY') or 16)
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+class CircuitOpenError(Exception):
+    '''Raised when calls to a host are failing and the circuit is open'''
+    pass
+
+def _status(e):
+    '''Return the HTTP status code of an exception if it has one'''
+    response = getattr(e, 'response', None)
+    return getattr(response, 'status_code', None)
+
+def isRetryable(e):
+    '''True if e is an overload or transient network error'''
+    import requests
+    if isinstance(e, (requests.ConnectionError, requests.Timeout)):
+        return True
+    return _status(e) in RETRY_STATUS
+
+
+class HostLimiter(object):
+    '''Token bucket, AIMD concurrency limit and circuit breaker for a host'''
+
+    def __init__(self, host, rate=RATE, burst=None, concurrency=2,
+                 max_concurrency=MAX_CONCURRENCY, slow_factor=3.0,
+                 failures=5, cooldown=30, retries=4, backoff=1.0):
+        self.host = host
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self.limit = float(concurrency)
+        self.max_concurrency = max_concurrency
+        self.slow_factor = slow_factor
+        self.failures = failures
+        self.cooldown = cooldown
+        self.retries = retries
+        self.backoff = backoff
+
+        self._cond = threading.Condition()
+        self._tokens = self.burst
+        self._refilled = time.time()
+        self._active = 0
+        self._latency = {}
+        self._decreased = 0
+        self._errors = 0
+        self._open_until = 0
+        self._trial = False
+
+    def __repr__(self):
+        return '<HostLimiter: {} ({:.1f} concurrent)>'.format(self.host,
+                                                             self.limit)
+
+    def _refill(self, now):
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def acquire(self):
+        '''Block until a token and a concurrency slot are free'''
+        with self._cond:
+            while True:
+                now = time.time()
+                if now < self._open_until:
+                    raise CircuitOpenError('Circuit open for {}'.format(
+                        self.host))
+                if self._trial:
+                    self._cond.wait()
+                    continue
+                if self._open_until:
+                    # cooldown is over, let one trial call through
+                    self._trial = True
+                    self._active += 1
+                    return
+                self._refill(now)
+                if self._active < int(self.limit) and self._tokens >= 1:
+                    self._tokens -= 1
+                    self._active += 1
+                    return
+                wait = None
+                if self._tokens < 1:
+                    wait = (1 - self._tokens) / self.rate
+                self._cond.wait(wait)
+
+    def release(self, latency, error=None, kind='default'):
+        '''Record the outcome of a call of kind and adjust the limits'''
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+            if error is not None and not isinstance(error, Exception):
+                # interrupted, the outcome says nothing about the host
+                self._trial = False
+                return
+            now = time.time()
+            overloaded = error is not None and isRetryable(error)
+            average = self._latency.get(kind)
+            slow = (kind is not None and average is not None and
+                    latency > average * self.slow_factor)
+            if kind is not None and not overloaded:
+                self._latency[kind] = latency if average is None else \
+                    0.8 * average + 0.2 * latency
+            if overloaded or slow:
+                # halve at most once per latency window
+                if now - self._decreased > (average or 1):
+                    self.limit = max(1.0, self.limit / 2)
+                    self._decreased = now
+                    logging.debug('Decreased {}'.format(self))
+            else:
+                self.limit = min(self.max_concurrency,
+                                 self.limit + 1.0 / self.limit)
+            if overloaded:
+                self._errors += 1
+                if self._trial or self._errors >= self.failures:
+                    self._open_until = now + self.cooldown
+                    logging.warning('Opened circuit for {} for {}s'.format(
+                        self.host, self.cooldown))
+            else:
+                self._errors = 0
+                self._open_until = 0
+            self._trial = False
+
+    def call(self, fn, *args, **kwargs):
+        '''
+        Call fn(*args, **kwargs) within the limits, retrying overload errors
+
+        Pass idempotent=False for calls that must not be repeated if the
+        server may have processed them; these are only retried on 429.
+        Pass kind to group calls of similar latency, or kind=None for calls
+        whose latency should not affect the concurrency limit.
+        '''
+        idempotent = kwargs.pop('idempotent', True)
+        kind = kwargs.pop('kind', 'default')
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                self.acquire()
+            except CircuitOpenError:
+                if attempt > self.retries:
+                    raise
+                with self._cond:
+                    wait = max(self._open_until - time.time(), 0)
+                time.sleep(wait + random.uniform(0, self.backoff))
+                continue
+            start = time.time()
+            error = None
+            try:
+                return fn(*args, **kwargs)
+            except BaseException as e:
+                error = e
+                if not isinstance(e, Exception):
+                    raise
+                retry = _status(e) == 429 or (idempotent and isRetryable(e))
+                if not retry or attempt > self.retries:
+                    raise
+            finally:
+                # also on KeyboardInterrupt or SystemExit, a leaked slot
+                # would block every other caller to the host
+                self.release(time.time() - start, error, kind)
+            delay = self.backoff * 2 ** (attempt - 1)
+            logging.info('{} from {}, retrying in {:.1f}s'.format(
+                _status(error) or type(error).__name__, self.host, delay))
+            time.sleep(delay + random.uniform(0, self.backoff))
+
+
+_limiters = {}
+_lock = threading.Lock()
+
+def getLimiter(host):
+    '''Return the shared HostLimiter for host'''
+    with _lock:
+        if host not in _limiters:
+            _limiters[host] = HostLimiter(host)
+        return _limiters[host]
+
+def configure(host, **params):
+    '''Replace the limiter for host with one using params'''
+    with _lock:
+        _limiters[host] = HostLimiter(host, **params)
+        return _limiters[host]
+
+def limited(host, fn, *args, **kwargs):
+    '''Call fn(*args, **kwargs) through the limiter for host'''
+    return getLimiter(host).call(fn, *args, **kwargs)
@@ -3,19 +3,26 @@ from __future__ import unicode_literals
 try: from builtins import str
 except: from __builtin__ import str
 
-import requests
 import json
 import logging
+import threading
+from .limiter import limited
+
+try: from urllib.parse import urlparse
+except: from urlparse import urlparse
 
 # global vars
 _api_url = None
 _api_key = None
+_session = None
+_session_lock = threading.Lock()
 
 def auth(token, url, check_auth=True):
     global _api_key, _api_url
     _api_key = token
     _api_url = url
     if check_auth:
+        import requests
         try:
             req('GET', '../auth/check-logged', auth=True, raw=True)
             return True
@@ -24,22 +31,44 @@ def auth(token, url, check_auth=True):
             logging.warning(e)
             return False
 
+def _getSession():
+    '''Return the shared requests session, creating it on first use'''
+    global _session
+    with _session_lock:
+        if _session is None:
+            # requests is imported on first use to keep imports fast
+            import requests
+            _session = requests.Session()
+    return _session
+
 def req(method, endpoint, payload=None, auth=False, raw=False):
     if _api_url is None:
-        raise(Exception('Uninitialized. Initialize with rw_api.init(<key>)'))
+        # default to the environment, as set by rw_api.init()
+        from . import init
+        init(check_auth=False)
 
     url = urljoin(_api_url, endpoint)
-    if method.lower() == 'get' and auth == False:
-        response = requests.get(url, payload)
-    else:
+    headers = None
+    if not (method.lower() == 'get' and auth == False):
         headers = {
             'Content-Type': 'application/json',
             'Authorization': 'Bearer {token}'.format(token=_api_key)
         }
         if type(payload) is dict: payload = json.dumps(payload)
-        response = requests.request(method, url, data=payload, headers=headers)
 
-    response.raise_for_status()
+    def send():
+        session = _getSession()
+        if headers is None:
+            response = session.get(url, params=payload)
+        else:
+            response = session.request(method, url, data=payload,
+                                       headers=headers)
+        response.raise_for_status()
+        return response
+
+    # POSTs are only retried if rejected with 429
+    response = limited(urlparse(url).netloc, send,
+                       idempotent=method.lower() != 'post')
     if raw:
         return response.text
     return response.json()['data']
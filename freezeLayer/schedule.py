@@ -0,0 +1,308 @@
+'''
+Rolling freeze scheduler
+
+Runs freezeLayer for declarative rolling windows from a single long-running
+process, keeping API connections and layer metadata warm between runs.
+
+Jobs are read from a json config:
+
+{
+    "jobs": [
+        {"layer": "<layerId>", "window": "day", "at": "01:00"},
+        {"layer": "<layerId>", "window": "week", "at": "02:00", "catchup": 4},
+        {"layer": "<layerId>", "window": "day", "name": "archive",
+         "export": "archive/{table}_{start:%Y%m%d}.parquet",
+         "create_table": false}
+    ]
+}
+
+Each job freezes the previous calendar window (hour, day or week, in UTC)
+once it has closed, delayed by "at" (HH:MM). The end of the last frozen
+window is saved in a state file, so after downtime missed windows are run
+in order, up to "catchup" of them. Windows of a job are never run
+concurrently and each window is only run once. A lock on <state file>.lock
+keeps a second scheduler from running on the same state file.
+
+Set "export" to a path template such as "archive/{table}_{start:%Y%m%d}.parquet"
+to also save each window to a local snapshot, and "create_table" to false to
+only save the snapshot.
+
+Jobs are identified by "name", defaulting to "<layerId>:<window>", which
+must be unique. Only one job per layer and window may create tables; others
+can only export snapshots. Frozen tables are named after the source table, the window
+and the first part of the layer id, so layers sharing a source table do not
+overwrite each other's tables.
+'''
+from __future__ import unicode_literals
+
+import os
+import json
+import time
+import fcntl
+import signal
+import datetime
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+from . import rw_api, csql, freezeLayer, frozenTableName, FutureDataError
+from .coverage import CoverageIndex
+
+STATE_FILE = '.freeze_schedule.json'
+WINDOWS = {
+    'hour': datetime.timedelta(hours=1),
+    'day': datetime.timedelta(days=1),
+    'week': datetime.timedelta(weeks=1)
+}
+_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+def windowStart(date, window):
+    '''Truncate date to the start of the window containing it'''
+    if window == 'hour':
+        return date.replace(minute=0, second=0, microsecond=0)
+    start = date.replace(hour=0, minute=0, second=0, microsecond=0)
+    if window == 'week':
+        start -= datetime.timedelta(days=start.weekday())
+    return start
+
+
+class RollingJob(object):
+    '''Freeze the previous window of a layer every window'''
+
+    def __init__(self, layer, window='day', at='00:00', catchup=7,
+                 time_field=None, table_name=None, export=None,
+                 create_table=True, name=None):
+        if window not in WINDOWS:
+            raise ValueError('Window must be one of {}'.format(
+                ', '.join(WINDOWS)))
+        hours, minutes = at.split(':')
+        self.layerId = layer
+        self.window = window
+        self.delay = datetime.timedelta(hours=int(hours), minutes=int(minutes))
+        self.catchup = catchup
+        self.time_field = time_field
+        self.table_name = table_name
+        self.export = export
+        self.create_table = create_table
+        self.key = name or '{}:{}'.format(layer, window)
+
+    def __repr__(self):
+        return '<RollingJob: {}>'.format(self.key)
+
+    def due(self, last_end, now):
+        '''
+        Return list of (start, end) windows that have closed by now and end
+        after last_end, oldest first. Only the latest window is due if
+        last_end is None.
+        '''
+        step = WINDOWS[self.window]
+        end = windowStart(now - self.delay, self.window)
+        windows = []
+        while len(windows) < max(self.catchup, 1):
+            if last_end is not None and end <= last_end:
+                break
+            windows.append((end - step, end))
+            if last_end is None:
+                break
+            end -= step
+        return windows[::-1]
+
+
+class Scheduler(object):
+    '''Run due RollingJobs on a bounded pool of threads'''
+
+    def __init__(self, jobs, state_file=STATE_FILE, workers=2, interval=60,
+                 metadata_ttl=3600, retry_delay=600):
+        keys = [job.key for job in jobs]
+        for key in set(keys):
+            if keys.count(key) > 1:
+                raise ValueError('Duplicate job {}, give each job on the same '
+                                 'layer and window a unique name'.format(key))
+        tables = [(job.layerId, job.window) for job in jobs
+                  if job.create_table]
+        for layer, window in set(tables):
+            if tables.count((layer, window)) > 1:
+                raise ValueError('More than one job creates tables for {} '
+                                 'every {}, set "create_table" to false on '
+                                 'all but one'.format(layer, window))
+        self.jobs = jobs
+        self.state_file = state_file
+        self.workers = workers
+        self.interval = interval
+        self.metadata_ttl = datetime.timedelta(seconds=metadata_ttl)
+        self.retry_delay = datetime.timedelta(seconds=retry_delay)
+        self._lock = threading.Lock()
+        self._running = set()
+        self._retry = {}
+        self._metadata = {}
+        self._coverage = {}
+        self._tables = {}
+        self._state = self.loadState()
+
+    @classmethod
+    def fromConfig(cls, config_file, **args):
+        '''Create Scheduler from a json config file'''
+        with open(config_file) as f:
+            config = json.load(f)
+        jobs = [RollingJob(**job) for job in config['jobs']]
+        return cls(jobs, **args)
+
+    def loadState(self):
+        '''Read {job key: end of last frozen window} from state file'''
+        if not os.path.exists(self.state_file):
+            return {}
+        with open(self.state_file) as f:
+            state = json.load(f)
+        return dict((k, datetime.datetime.strptime(v, _DATE_FORMAT))
+                    for k, v in state.items())
+
+    def saveState(self):
+        '''Write state file, call while holding self._lock'''
+        state = dict((k, v.strftime(_DATE_FORMAT))
+                     for k, v in self._state.items())
+        tmp = self.state_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f, sort_keys=True, indent=2)
+        os.rename(tmp, self.state_file)
+
+    def _getMetadata(self, job):
+        '''Return (layer, table_name, time_field), cached for metadata_ttl'''
+        now = datetime.datetime.utcnow()
+        cached = self._metadata.get(job.layerId)
+        if cached and now - cached[0] < self.metadata_ttl:
+            return cached[1]
+        logging.info('Fetching layer definition for {}'.format(job.layerId))
+        layer = rw_api.getLayer(job.layerId)
+        table_name, time_field = job.table_name, job.time_field
+        if not table_name or not time_field:
+            dataset = layer.getDataset()
+            table_name = table_name or dataset.tableName
+            time_field = time_field or dataset.mainDateField
+        metadata = (layer, table_name, time_field)
+        self._metadata[job.layerId] = (now, metadata)
+        return metadata
+
+    def _refreshCoverage(self, table_name, time_field):
+        '''
+        Return refreshed CoverageIndex, shared by jobs on the same table, or
+        None if it can't be refreshed, e.g. the first full query timed out
+        '''
+        key = (table_name, time_field)
+        with self._lock:
+            if key not in self._coverage:
+                self._coverage[key] = (CoverageIndex(table_name, time_field),
+                                       threading.Lock())
+            coverage, lock = self._coverage[key]
+        with lock:
+            try:
+                return coverage.refresh()
+            except Exception:
+                logging.exception('Could not refresh {}, querying the '
+                                  'latest date instead'.format(coverage))
+                return None
+
+    def _tableLock(self, new_table):
+        '''Return lock shared by jobs freezing to new_table'''
+        with self._lock:
+            if new_table not in self._tables:
+                self._tables[new_table] = threading.Lock()
+            return self._tables[new_table]
+
+    def _run(self, job, start, end):
+        '''Freeze one window of job'''
+        try:
+            layer, table_name, time_field = self._getMetadata(job)
+            coverage = self._refreshCoverage(table_name, time_field)
+            export = job.export and job.export.format(
+                table=table_name, layer=job.layerId, start=start, end=end)
+            new_table = frozenTableName(table_name, start, end,
+                                        job.layerId.split('-')[0])
+            # jobs freezing to the same table run one at a time
+            with self._tableLock(new_table):
+                lyr, table = freezeLayer(layer, start, end, time_field,
+                                         table_name, coverage=coverage,
+                                         export=export,
+                                         create_table=job.create_table,
+                                         new_table=new_table)
+            logging.info('{} froze {} to {}: layer {}, table {}'.format(
+                job, start, end, lyr and lyr.Id, table))
+            with self._lock:
+                self._state[job.key] = end
+                self._retry.pop(job.key, None)
+                self.saveState()
+        except FutureDataError as e:
+            logging.info('{} waiting for data until {}: {}'.format(
+                job, end, e))
+            self._deferJob(job)
+        except Exception:
+            logging.exception('{} failed for {} to {}'.format(job, start, end))
+            self._metadata.pop(job.layerId, None)
+            self._deferJob(job)
+        finally:
+            with self._lock:
+                self._running.discard(job.key)
+
+    def _deferJob(self, job):
+        with self._lock:
+            self._retry[job.key] = datetime.datetime.utcnow() + self.retry_delay
+
+    def tick(self, pool, now=None):
+        '''Submit the oldest due window of each idle job to pool'''
+        now = now or datetime.datetime.utcnow()
+        for job in self.jobs:
+            with self._lock:
+                if job.key in self._running:
+                    continue
+                if self._retry.get(job.key, now) > now:
+                    continue
+                due = job.due(self._state.get(job.key), now)
+                if not due:
+                    continue
+                self._running.add(job.key)
+            start, end = due[0]
+            logging.info('{} running window {} to {}'.format(job, start, end))
+            pool.apply_async(self._run, (job, start, end))
+
+    def _lock_process(self):
+        '''Return descriptor of the lock file, held while the process lives'''
+        lock_file = self.state_file + '.lock'
+        fd = os.open(lock_file, os.O_CREAT | os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            pid = os.read(fd, 32).decode('utf-8')
+            os.close(fd)
+            raise Exception('Scheduler already running (pid {}), lock held '
+                            'on {}'.format(pid, lock_file))
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode('utf-8'))
+        return fd
+
+    def run(self, production=False):
+        '''Initialize API clients once and run due jobs until interrupted'''
+        # the lock is released by the OS if the process dies
+        fd = self._lock_process()
+
+        # exit cleanly on SIGTERM, e.g. docker stop
+        def stop(signum, frame):
+            raise SystemExit('Received signal {}'.format(signum))
+        handler = signal.signal(signal.SIGTERM, stop)
+
+        pool = None
+        try:
+            csql.init()
+            rw_api.init(production=production)
+            pool = ThreadPool(self.workers)
+            logging.info('Scheduler started with {} jobs'.format(
+                len(self.jobs)))
+            while True:
+                self.tick(pool)
+                time.sleep(self.interval)
+        finally:
+            logging.info('Scheduler stopping, waiting for running jobs')
+            signal.signal(signal.SIGTERM, handler)
+            if pool is not None:
+                pool.close()
+                pool.join()
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
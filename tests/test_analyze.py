@@ -0,0 +1,95 @@
+import json
+
+from freezeLayer import rw_api, analyze
+from freezeLayer.analyze import analyzeLayers, sqlHash
+
+SQL = ("select * from t where utc > now() - interval '1 day' "
+       "and pm25 > 0")
+
+def layer(Id, sql=SQL, provider='cartodb', dataset='D'):
+    config = {'body': {'layers': [{'options': {'sql': sql}}]}}
+    return rw_api.Layer(Id, attributes={'name': Id, 'provider': provider,
+                                        'dataset': dataset,
+                                        'layerConfig': config})
+
+def dataset(Id='D', time_field='utc'):
+    return rw_api.Dataset(Id, attributes={'tableName': 't',
+                                          'mainDateField': time_field})
+
+def analyzeOne(lyr, datasets=None, cache_file=None):
+    datasets = [dataset()] if datasets is None else datasets
+    (result,) = analyzeLayers([lyr], datasets, cache_file, processes=1)
+    return result
+
+
+def test_freezable_layer():
+    result = analyzeOne(layer('L'))
+    assert result['freezable']
+    assert result['reason'] is None
+    assert result['tableName'] == 't'
+    assert result['clauses'] == [" utc > now() - interval '1 day'"]
+
+def test_provider_must_be_cartodb():
+    result = analyzeOne(layer('L', provider='gee'))
+    assert not result['freezable']
+    assert result['reason'] == "Provider is gee, not 'cartodb'"
+
+def test_dataset_not_found():
+    result = analyzeOne(layer('L', dataset='X'))
+    assert result['reason'] == 'Dataset X not found'
+
+def test_dataset_needs_main_date_field():
+    result = analyzeOne(layer('L'), [dataset(time_field=None)])
+    assert result['reason'] == 'Dataset does not have mainDateField defined'
+
+def test_layer_needs_sql():
+    lyr = layer('L')
+    lyr.attributes['layerConfig'] = {}
+    result = analyzeOne(lyr)
+    assert result['reason'] == 'Layer config does not contain sql'
+
+def test_sql_without_time_clauses():
+    result = analyzeOne(layer('L', sql='select * from t where pm25 > 0'))
+    assert not result['freezable']
+    assert result['clauses'] == []
+    assert result['reason'] == 'No where clauses refer to utc'
+
+def test_clauses_that_cannot_be_replaced():
+    # the trailing clause is found without its last token
+    result = analyzeOne(layer('L', sql="select * from t where utc > "
+                                       "now() - interval '1 day'"))
+    assert not result['freezable']
+    assert result['reason'] == 'Time clauses cannot be fully replaced'
+
+def test_cache_hits_skip_parsing(tmp_path):
+    cache_file = str(tmp_path / 'cache.json')
+    lyr = layer('L')
+    analyzeOne(lyr, cache_file=cache_file)
+    with open(cache_file) as f:
+        cache = json.load(f)
+    key = sqlHash(SQL, 'utc')
+    assert cache == {key: {'clauses': [" utc > now() - interval '1 day'"],
+                           'reason': None}}
+
+    # a reparse would not find this clause
+    cache[key] = {'clauses': [' cached'], 'reason': None}
+    with open(cache_file, 'w') as f:
+        json.dump(cache, f)
+    assert analyzeOne(lyr, cache_file=cache_file)['clauses'] == [' cached']
+
+def test_cache_keeps_reasons(tmp_path):
+    cache_file = str(tmp_path / 'cache.json')
+    sql = "select * from t where utc > now() - interval '1 day'"
+    analyzeOne(layer('L', sql=sql), cache_file=cache_file)
+    result = analyzeOne(layer('L', sql=sql), cache_file=cache_file)
+    assert result['reason'] == 'Time clauses cannot be fully replaced'
+
+def test_sql_hash_depends_on_time_field():
+    assert sqlHash(SQL, 'utc') == sqlHash(SQL, 'utc')
+    assert sqlHash(SQL, 'utc') != sqlHash(SQL, 'date')
+
+def test_replaces_cleanly():
+    sql = "select * from t where utc > '2018-01-01'::timestamp"
+    assert not analyze.replacesCleanly(sql, 'utc', [" utc > '2018-01-01'::"])
+    assert analyze.replacesCleanly(SQL, 'utc',
+                                   [" utc > now() - interval '1 day'"])
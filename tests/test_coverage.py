@@ -0,0 +1,63 @@
+import datetime
+
+from freezeLayer import coverage
+from freezeLayer.coverage import CoverageIndex
+
+class FakeCarto(object):
+    '''Stands in for cartosql, returning rows for each query'''
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def get(self, sql, *args, **kwargs):
+        self.queries.append(sql)
+        rows = self.rows
+
+        class Response(object):
+            def json(self):
+                return {'rows': rows}
+        return Response()
+
+def bucket(hour, n, last_minute=59):
+    return {'bucket': '2018-08-11T{:02d}:00:00Z'.format(hour), 'n': n,
+            'first': '2018-08-11T{:02d}:00:00Z'.format(hour),
+            'last': '2018-08-11T{:02d}:{:02d}:00Z'.format(hour, last_minute)}
+
+def index(tmp_path, rows, monkeypatch):
+    monkeypatch.setattr(coverage, 'csql', FakeCarto(rows))
+    monkeypatch.setattr(coverage, 'cartoCall',
+                        lambda fn, *args, **kwargs: fn(*args))
+    return CoverageIndex('t', 'utc', path=str(tmp_path / 'index.json'))
+
+
+def test_count_prorates_partial_buckets(tmp_path, monkeypatch):
+    idx = index(tmp_path, [bucket(0, 60), bucket(1, 30)], monkeypatch)
+    idx.refresh()
+    assert idx.total() == 90
+    assert idx.count('2018-08-11T00:00Z', '2018-08-11T02:00Z') == 90
+    assert idx.count('2018-08-11T00:30Z', '2018-08-11T01:30Z') == 45
+    assert idx.count('2018-08-11T05:00Z', '2018-08-11T06:00Z') == 0
+
+def test_latest_and_daily(tmp_path, monkeypatch):
+    idx = index(tmp_path, [bucket(0, 60), bucket(1, 30, 30)], monkeypatch)
+    idx.refresh()
+    assert idx.earliest().isoformat() == '2018-08-11T00:00:00+00:00'
+    assert idx.latest().isoformat() == '2018-08-11T01:30:00+00:00'
+    assert idx.daily() == [(datetime.date(2018, 8, 11), 90)]
+
+def test_refresh_is_incremental_and_saved(tmp_path, monkeypatch):
+    idx = index(tmp_path, [bucket(0, 60), bucket(1, 30, 30)], monkeypatch)
+    idx.refresh()
+    assert 'WHERE' not in coverage.csql.queries[0]
+
+    idx = index(tmp_path, [bucket(1, 40, 45), bucket(2, 10)], monkeypatch)
+    assert idx.total() == 90
+    idx.refresh()
+    assert "utc >= '2018-08-11T01:00:00'" in coverage.csql.queries[0]
+    assert idx.total() == 110
+    assert idx.latest().isoformat() == '2018-08-11T02:59:00+00:00'
+
+def test_empty_index(tmp_path, monkeypatch):
+    idx = index(tmp_path, [], monkeypatch)
+    assert idx.latest() is None
+    assert idx.count('2018-08-11', '2018-08-12') == 0
@@ -0,0 +1,161 @@
+import io
+import os
+import gzip
+import json
+import decimal
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+import requests
+
+from freezeLayer import export
+
+FIELDS = {'fields': OrderedDict([
+    ('cartodb_id', {'type': 'number'}),
+    ('name', {'type': 'string'}),
+    ('n', {'type': 'number'}),
+    ('ok', {'type': 'boolean'}),
+    ('the_geom', {'type': 'geometry'}),
+    ('the_geom_webmercator', {'type': 'geometry'})
+])}
+# columns in a different order than the schema
+CSV = (b'ok,n,the_geom,name\n'
+       b'true,1.5,"{""type"":""Point"",""coordinates"":[1,2]}","a,\nb"\n'
+       b'false,,,c\n')
+ROWS = [['a,\nb', 1.5, True, {'type': 'Point', 'coordinates': [1, 2]}],
+        ['c', None, False, None]]
+
+# integers beyond float precision
+BIG_FIELDS = {'fields': OrderedDict([
+    ('id', {'type': 'number', 'pgtype': 'int8'}),
+    ('x', {'type': 'number', 'pgtype': 'float8'}),
+    ('total', {'type': 'number', 'pgtype': 'numeric'})
+])}
+BIG_CSV = (b'id,x,total\n'
+           b'9007199254740993,0.1,123456789012345678901234567890.1\n')
+
+class Response(object):
+    '''Stands in for a streaming requests response'''
+    def __init__(self, data, fail=False, fields=FIELDS):
+        self.raw = io.BytesIO(data)
+        self.data = data
+        self.fail = fail
+        self.fields = fields
+
+    def iter_content(self, size):
+        yield self.data[:5]
+        if self.fail:
+            raise IOError('connection lost')
+        yield self.data[5:]
+
+    def json(self, **args):
+        return json.loads(json.dumps(self.fields), **args)
+
+    def close(self):
+        pass
+
+class Handler(BaseHTTPRequestHandler):
+    '''Serves CSV with a Content-Length, gzipped if the path says so'''
+    def do_GET(self):
+        body = gzip.compress(CSV) if self.path == '/gzip' else CSV
+        self.send_response(200)
+        if self.path == '/gzip':
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(server.server_port)
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+@pytest.fixture
+def queries(monkeypatch):
+    queries = []
+
+    def post(sql, f, kind=None):
+        queries.append((sql, f))
+        return Response(CSV)
+    monkeypatch.setattr(export, '_post', post)
+    return queries
+
+
+def test_snapshot_format():
+    assert export.snapshotFormat('a.csv.gz') == ('csv', True)
+    assert export.snapshotFormat('a.geojson') == ('geojson', False)
+    assert export.snapshotFormat('a.parquet') == ('parquet', False)
+    with pytest.raises(ValueError):
+        export.snapshotFormat('a.parquet.gz')
+
+def test_export_sql_selects_geometry_as_geojson(tmp_path, queries):
+    export.exportQuery('select * from t', str(tmp_path / 'a.csv.gz'))
+    assert queries[-1] == ('SELECT name, n, ok, ST_AsGeoJSON(the_geom) AS '
+                           'the_geom FROM (select * from t) q', 'csv')
+
+def test_csv_round_trip(tmp_path, queries):
+    path = str(tmp_path / 'a.csv.gz')
+    export.exportQuery('q', path)
+    with open(path + '.schema.json') as f:
+        schema = json.load(f, object_pairs_hook=OrderedDict)
+    assert schema == OrderedDict([('name', 'text'), ('n', 'numeric'),
+                                  ('ok', 'boolean'), ('the_geom', 'geometry')])
+    assert list(export._readRows(path, schema)) == ROWS
+
+def test_parquet_round_trip(tmp_path, queries):
+    pytest.importorskip('pyarrow')
+    path = str(tmp_path / 'a.parquet')
+    export.exportQuery('q', path)
+    with open(path + '.schema.json') as f:
+        schema = json.load(f, object_pairs_hook=OrderedDict)
+    assert list(export._readRows(path, schema)) == ROWS
+
+@pytest.mark.parametrize('path', ['/plain', '/gzip'])
+def test_parquet_export_of_http_response(tmp_path, monkeypatch, server, path):
+    pytest.importorskip('pyarrow')
+    response = requests.get(server + path, stream=True)
+    monkeypatch.setattr(export, '_post', lambda sql, f, kind=None:
+                        Response(CSV) if f == 'json' else response)
+    snapshot = str(tmp_path / 'a.parquet')
+    export.exportQuery('q', snapshot)
+    with open(snapshot + '.schema.json') as f:
+        schema = json.load(f, object_pairs_hook=OrderedDict)
+    assert list(export._readRows(snapshot, schema)) == ROWS
+
+@pytest.mark.parametrize('name', ['a.csv.gz', 'a.parquet'])
+def test_large_numbers_round_trip_exactly(tmp_path, monkeypatch, name):
+    if name.endswith('parquet'):
+        pytest.importorskip('pyarrow')
+    monkeypatch.setattr(export, '_post', lambda sql, f, kind=None:
+                        Response(BIG_CSV, fields=BIG_FIELDS))
+    path = str(tmp_path / name)
+    export.exportQuery('q', path)
+    with open(path + '.schema.json') as f:
+        schema = json.load(f, object_pairs_hook=OrderedDict)
+    assert list(schema.values()) == ['bigint', 'double precision', 'numeric']
+    (row,) = export._readRows(path, schema)
+    assert row == [9007199254740993, 0.1,
+                   decimal.Decimal('123456789012345678901234567890.1')]
+    # the values handed to insertRows print as the original text
+    assert [str(v) for v in row] == BIG_CSV.decode().split()[1].split(',')
+
+def test_interrupted_export_leaves_no_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(export, '_post', lambda sql, f, kind=None:
+                        Response(CSV, fail=True))
+    with pytest.raises(IOError):
+        export.exportQuery('q', str(tmp_path / 'a.csv.gz'))
+    assert os.listdir(str(tmp_path)) == []
+
+def test_geojson_cannot_be_loaded(tmp_path):
+    with pytest.raises(ValueError):
+        export.loadSnapshot(str(tmp_path / 'a.geojson.gz'), 't')
@@ -0,0 +1,115 @@
+import time
+
+import pytest
+import requests
+
+from freezeLayer.rw_api.limiter import HostLimiter, CircuitOpenError
+
+def httpError(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(str(status), response=response)
+
+def failing(status, calls=None):
+    def fn():
+        if calls is not None:
+            calls.append(1)
+        raise httpError(status)
+    return fn
+
+def limiter(**args):
+    params = dict(rate=1000, concurrency=4, retries=0, backoff=0.001)
+    params.update(args)
+    return HostLimiter('host', **params)
+
+
+def test_success_increases_limit():
+    l = limiter()
+    for i in range(8):
+        l.call(lambda: None)
+    assert 5 < l.limit < 6
+
+def test_overload_halves_limit():
+    l = limiter()
+    with pytest.raises(requests.HTTPError):
+        l.call(failing(503))
+    assert l.limit == 2
+
+def test_client_error_does_not_halve():
+    l = limiter()
+    with pytest.raises(requests.HTTPError):
+        l.call(failing(404))
+    assert l.limit > 4
+
+def test_slow_call_halves_limit_for_its_kind():
+    l = limiter()
+    for i in range(5):
+        l.call(time.sleep, 0.001)
+    before = l.limit
+    l.call(time.sleep, 0.05, kind='copy')
+    l.call(time.sleep, 0.05, kind=None)
+    assert l.limit > before
+    l.call(time.sleep, 0.05)
+    assert l.limit < before
+
+def test_retries_idempotent_calls():
+    calls = []
+    l = limiter(retries=2)
+    with pytest.raises(requests.HTTPError):
+        l.call(failing(503, calls))
+    assert len(calls) == 3
+
+def test_non_idempotent_calls_only_retried_on_429():
+    calls = []
+    l = limiter(retries=2)
+    with pytest.raises(requests.HTTPError):
+        l.call(failing(503, calls), idempotent=False)
+    assert len(calls) == 1
+    with pytest.raises(requests.HTTPError):
+        l.call(failing(429, calls), idempotent=False)
+    assert len(calls) == 4
+
+def test_circuit_opens_and_recovers():
+    l = limiter(failures=2, cooldown=0.05)
+    for i in range(2):
+        with pytest.raises(requests.HTTPError):
+            l.call(failing(503))
+    with pytest.raises(CircuitOpenError):
+        l.acquire()
+    time.sleep(0.06)
+    # a failing trial call reopens the circuit
+    with pytest.raises(requests.HTTPError):
+        l.call(failing(503))
+    with pytest.raises(CircuitOpenError):
+        l.acquire()
+    time.sleep(0.06)
+    assert l.call(lambda: 'ok') == 'ok'
+    assert l.call(lambda: 'ok') == 'ok'
+
+def test_token_bucket_limits_rate():
+    l = limiter(rate=50, burst=1)
+    start = time.time()
+    for i in range(6):
+        l.call(lambda: None)
+    assert time.time() - start >= 0.09
+
+def test_interrupted_call_releases_slot():
+    l = limiter(concurrency=1)
+    def interrupt():
+        raise KeyboardInterrupt()
+    with pytest.raises(KeyboardInterrupt):
+        l.call(interrupt)
+    assert l._active == 0
+    assert l.call(lambda: 'ok') == 'ok'
+
+def test_interrupted_trial_lets_next_trial_through():
+    l = limiter(failures=1, cooldown=0.05)
+    with pytest.raises(requests.HTTPError):
+        l.call(failing(503))
+    time.sleep(0.06)
+    def interrupt():
+        raise SystemExit()
+    with pytest.raises(SystemExit):
+        l.call(interrupt)
+    assert not l._trial
+    assert l.call(lambda: 'ok') == 'ok'
@@ -0,0 +1,100 @@
+import datetime
+import time
+
+import pytest
+from multiprocessing.pool import ThreadPool
+
+from freezeLayer import schedule
+from freezeLayer.schedule import RollingJob, Scheduler, windowStart
+
+def dt(*args):
+    return datetime.datetime(*args)
+
+
+def test_window_start():
+    date = dt(2018, 8, 11, 13, 45)      # a Saturday
+    assert windowStart(date, 'hour') == dt(2018, 8, 11, 13)
+    assert windowStart(date, 'day') == dt(2018, 8, 11)
+    assert windowStart(date, 'week') == dt(2018, 8, 6)
+
+def test_due_without_state_is_latest_window():
+    job = RollingJob('L', 'day', at='01:00')
+    assert job.due(None, dt(2018, 8, 12, 0, 30)) == [
+        (dt(2018, 8, 10), dt(2018, 8, 11))]
+    assert job.due(None, dt(2018, 8, 12, 1, 30)) == [
+        (dt(2018, 8, 11), dt(2018, 8, 12))]
+
+def test_due_catches_up_oldest_first():
+    job = RollingJob('L', 'day', catchup=7)
+    due = job.due(dt(2018, 8, 9), dt(2018, 8, 12, 6))
+    assert due == [(dt(2018, 8, 9), dt(2018, 8, 10)),
+                   (dt(2018, 8, 10), dt(2018, 8, 11)),
+                   (dt(2018, 8, 11), dt(2018, 8, 12))]
+
+def test_due_catchup_is_capped():
+    job = RollingJob('L', 'day', catchup=2)
+    due = job.due(dt(2018, 8, 1), dt(2018, 8, 12, 6))
+    assert due == [(dt(2018, 8, 10), dt(2018, 8, 11)),
+                   (dt(2018, 8, 11), dt(2018, 8, 12))]
+
+def test_nothing_due_once_frozen():
+    job = RollingJob('L', 'week')
+    assert job.due(dt(2018, 8, 6), dt(2018, 8, 12, 6)) == []
+
+def test_invalid_window():
+    with pytest.raises(ValueError):
+        RollingJob('L', 'month')
+
+def test_duplicate_jobs_rejected(tmp_path):
+    state = str(tmp_path / 'state.json')
+    with pytest.raises(ValueError):
+        Scheduler([RollingJob('L'), RollingJob('L', at='02:00')],
+                  state_file=state)
+    with pytest.raises(ValueError):
+        Scheduler([RollingJob('L'), RollingJob('L', name='archive')],
+                  state_file=state)
+    scheduler = Scheduler([RollingJob('L'),
+                           RollingJob('L', name='archive', export='a.csv.gz',
+                                      create_table=False),
+                           RollingJob('L', 'week')], state_file=state)
+    assert [j.key for j in scheduler.jobs] == ['L:day', 'archive', 'L:week']
+
+def test_tick_runs_windows_in_order_once(tmp_path, monkeypatch):
+    calls = []
+
+    class Layer(object):
+        Id = 'new'
+
+    def freezeLayer(layer, start, end, *args, **kwargs):
+        calls.append((start, end, kwargs['new_table']))
+        return Layer(), kwargs['new_table']
+
+    monkeypatch.setattr(schedule, 'freezeLayer', freezeLayer)
+    state = str(tmp_path / 'state.json')
+    job = RollingJob('abc-def', 'day', catchup=3)
+    scheduler = Scheduler([job], state_file=state)
+    scheduler._getMetadata = lambda job: ('layer', 'src', 'utc')
+    scheduler._refreshCoverage = lambda *args: None
+    scheduler._state[job.key] = dt(2018, 8, 9)
+
+    pool = ThreadPool(2)
+    for i in range(5):
+        scheduler.tick(pool, dt(2018, 8, 12, 6))
+        time.sleep(0.05)
+    pool.close()
+    pool.join()
+
+    assert [c[:2] for c in calls] == [(dt(2018, 8, 9), dt(2018, 8, 10)),
+                                      (dt(2018, 8, 10), dt(2018, 8, 11)),
+                                      (dt(2018, 8, 11), dt(2018, 8, 12))]
+    assert calls[0][2] == 'src_20180809_0000_20180810_0000_abc'
+    assert Scheduler([job], state_file=state)._state == {
+        job.key: dt(2018, 8, 12)}
+
+def test_failed_coverage_refresh_falls_back(tmp_path, monkeypatch):
+    def refresh(self):
+        raise Exception('statement timeout')
+    monkeypatch.setattr(schedule.CoverageIndex, 'refresh', refresh)
+    monkeypatch.setattr(schedule.CoverageIndex, 'load', lambda self: self)
+    scheduler = Scheduler([], state_file=str(tmp_path / 'state.json'))
+    assert scheduler._refreshCoverage('src', 'utc') is None